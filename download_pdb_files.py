@@ -1,33 +1,61 @@
-import os, sys, logging, argparse, requests
+import os, sys, logging, argparse, httpx
+from concurrent.futures import ThreadPoolExecutor
 
 MICROSOFT_SYMBOL_STORE = "https://msdl.microsoft.com/download/symbols"
 
-def try_download_pdb(url, filename, guid, output_filename):
+CLIENT = httpx.Client(http2=True, follow_redirects=True, timeout=httpx.Timeout(30, connect=5),
+                      limits=httpx.Limits(max_connections=32, max_keepalive_connections=32))
+
+def try_download_pdb(url, filename, guid, output_filename, client=CLIENT, revalidate=False):
     pdb_url = f"{url}/{filename}/{guid}/{filename}"
+    etag_filename = output_filename + ".etag"
+    headers = {}
+    if os.path.exists(output_filename) and os.path.getsize(output_filename) > 0:
+        if not revalidate:
+            logging.debug("[=] already downloaded : %s" % output_filename)
+            return 200
+        if os.path.exists(etag_filename):
+            with open(etag_filename, "r") as f:
+                headers["If-None-Match"] = f.read().strip()
     logging.debug("[-] testing url : %s" % pdb_url)
-    response = requests.get(pdb_url, stream=True)
-    if response.status_code != 200:
-        logging.warning("[x] not found pdb at url : %s" % pdb_url)
+    if not headers:
+        head = client.head(pdb_url, timeout=5)
+        if head.status_code != 200:
+            logging.warning("[x] not found pdb at url : %s" % pdb_url)
+            return head.status_code
+    with client.stream("GET", pdb_url, headers=headers) as response:
+        if response.status_code == 304:
+            logging.info("[=] pdb not modified : %s" % pdb_url)
+            return 200
+        if response.status_code != 200:
+            logging.warning("[x] failed to fetch pdb at url : %s" % pdb_url)
+            return response.status_code
+        logging.info("[+] found pdb at url : %s" % pdb_url)
+        os.makedirs(os.path.dirname(output_filename), exist_ok=True)
+        with open(output_filename + ".part", 'wb') as f:
+            for data in response.iter_bytes(1024*1024):
+                f.write(data)
+        os.replace(output_filename + ".part", output_filename)
+        etag = response.headers.get("ETag")
+        if etag:
+            with open(etag_filename, "w") as f:
+                f.write(etag)
         return response.status_code
-    logging.info("[+] found pdb at url : %s" % pdb_url)
-    os.makedirs(os.path.dirname(output_filename), exist_ok=True)
-    with open(output_filename, 'wb') as f:
-        for data in response.iter_content(32*1024):
-            f.write(data)
-    return response.status_code
 
 if __name__ == '__main__':
-    logging.getLogger('requests').setLevel(logging.WARNING)
-    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    for name in ('httpx', 'httpcore', 'hpack'):
+        logging.getLogger(name).setLevel(logging.WARNING)
     p = argparse.ArgumentParser("download pdb from microsoft symbol store")
     p.add_argument("--name", type=str, required=True)
     p.add_argument("--pdb", type=str, required=True)
     p.add_argument("--dir", type=str, required=True)
+    p.add_argument("-j", "--jobs", type=int, default=16)
+    p.add_argument("--revalidate", action="store_true")
     p.add_argument("-v", "--verbose", action="store_true")
     args = p.parse_args()
     logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.INFO)
     with open(args.pdb, "r") as f:
-        guids = f.read().split()
-    for guid in guids:
-        out = os.path.join(args.dir, guid, args.name)
-        try_download_pdb(MICROSOFT_SYMBOL_STORE, args.name, guid, out)
+        guids = list(dict.fromkeys(f.read().split()))
+    jobs = [(guid, os.path.join(args.dir, guid, args.name)) for guid in guids]
+    with ThreadPoolExecutor(max_workers=args.jobs) as ex:
+        list(ex.map(lambda j: try_download_pdb(MICROSOFT_SYMBOL_STORE, args.name, j[0], j[1], revalidate=args.revalidate), jobs))
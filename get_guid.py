@@ -1,11 +1,53 @@
-import pefile, struct, sys
-
-pe = pefile.PE(sys.argv[1] if len(sys.argv) > 1 else './dlls/ntdll.dll')
-for dbg in pe.DIRECTORY_ENTRY_DEBUG:
-    if dbg.struct.Type == 2:
-        data = pe.__data__[dbg.struct.PointerToRawData:dbg.struct.PointerToRawData + dbg.struct.SizeOfData]
-        if data[:4] == b'RSDS':
-            d1, d2, d3 = struct.unpack('<IHH', data[4:12])
-            d4 = data[12:20]
-            age = struct.unpack('<I', data[20:24])[0]
-            print('%08X%04X%04X%s%X' % (d1, d2, d3, d4.hex().upper(), age))
+import mmap, struct, sys
+
+_U16 = struct.Struct('<H')
+_U32 = struct.Struct('<I')
+_DATA_DIR = struct.Struct('<II')
+_SECTION = struct.Struct('<IIII')
+_DEBUG_DIR = struct.Struct('<IIII')
+_RSDS = struct.Struct('<4sIHH8sI')
+
+def _fmt(d1, d2, d3, d4, age):
+    return '%08X%04X%04X%s%X' % (d1, d2, d3, d4.hex().upper(), age)
+
+def _rva2off(mm, sec, nsec, rva):
+    for i in range(nsec):
+        vsz, va, rawsz, rawptr = _SECTION.unpack_from(mm, sec + i*40 + 8)
+        if va <= rva < va + max(vsz, rawsz): return rva - va + rawptr
+    return None
+
+def _debug_dir_guids(mm):
+    pe = _U32.unpack_from(mm, 0x3C)[0]
+    if mm[pe:pe+4] != b'PE\0\0': return
+    nsec, = _U16.unpack_from(mm, pe + 6)
+    opt_sz, = _U16.unpack_from(mm, pe + 20)
+    opt = pe + 24
+    magic, = _U16.unpack_from(mm, opt)
+    dbg_rva, dbg_sz = _DATA_DIR.unpack_from(mm, opt + (0x70 if magic == 0x20B else 0x60) + 6*8)
+    dbg = _rva2off(mm, opt + opt_sz, nsec, dbg_rva) if dbg_rva else None
+    if dbg is None: return
+    for e in range(dbg, dbg + dbg_sz, 28):
+        typ, size, _, ptr = _DEBUG_DIR.unpack_from(mm, e + 12)
+        if typ == 2 and size >= _RSDS.size:
+            sig, d1, d2, d3, d4, age = _RSDS.unpack_from(mm, ptr)
+            if sig == b'RSDS': yield _fmt(d1, d2, d3, d4, age)
+
+def _scan_guids(mm):
+    # no usable debug directory: look for RSDS records directly, rejecting
+    # matches in code/data by a sane age and a NUL-terminated .pdb path
+    i = mm.find(b'RSDS')
+    while i >= 0 and i + _RSDS.size <= len(mm):
+        sig, d1, d2, d3, d4, age = _RSDS.unpack_from(mm, i)
+        end = mm.find(b'\0', i + _RSDS.size, i + _RSDS.size + 260)
+        if age < 1 << 20 and end > 0 and mm[end-4:end].lower() == b'.pdb':
+            yield _fmt(d1, d2, d3, d4, age)
+        i = mm.find(b'RSDS', i + 4)
+
+def get_guids(path):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        try: guids = list(_debug_dir_guids(mm))
+        except struct.error: guids = []
+        return guids or list(_scan_guids(mm))
+
+for guid in get_guids(sys.argv[1] if len(sys.argv) > 1 else './dlls/ntdll.dll'):
+    print(guid)
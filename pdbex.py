@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import sys, struct, argparse, os
+import sys, io, struct, argparse, os, functools, marshal
 
 try:
     import pdbparse
@@ -10,8 +10,8 @@ except ImportError:
     sys.exit(1)
 
 def _toidx(val):
-    if val is None: return None
     if isinstance(val, int): return val
+    if val is None: return None
     for a in ('tpi_idx', 'type_index'):
         if hasattr(val, a): return int(getattr(val, a))
     if hasattr(val, 'index'):
@@ -45,6 +45,11 @@ _BASE_SZ = {
     0x42:10, 0x14:16, 0x24:16, 0x43:16,
 }
 
+_BASE_SZ_TBL = bytearray(256)
+for k, v in _BASE_SZ.items(): _BASE_SZ_TBL[k] = v
+_MODE_SZ = bytes([0, 2, 2, 2, 4, 4, 8] + [0] * 9)
+
+@functools.lru_cache(maxsize=4096)
 def _resolve_base(ti):
     base = ti & 0xFF
     mode = (ti >> 8) & 0xF
@@ -52,25 +57,81 @@ def _resolve_base(ti):
     if mode in (1,2,3,4,5,6): return f"{s} *"
     return s
 
+def _base_sz(ti):
+    return _MODE_SZ[(ti >> 8) & 0xF] or _BASE_SZ_TBL[ti & 0xFF]
+
+_IDX_VERSION = 3
+
 class Resolver:
     def __init__(self, path):
-        self.pdb = pdbparse.parse(path, fast_load=False)
-        if not hasattr(self.pdb, 'STREAM_TPI'):
-            self.pdb.STREAM_TPI = self.pdb.streams[2]
-            self.pdb.STREAM_TPI.load(unnamed_hack=True, elim_fwdrefs=True)
-        self.types = self.pdb.STREAM_TPI.types
+        self.path = path
         self._cache = {}
+        self._sz_cache = {}
         self._printed = set()
-        self.structs, self.unions, self.enums = {}, {}, {}
+
+    @functools.cached_property
+    def pdb(self):
+        pdb = pdbparse.parse(self.path, fast_load=False)
+        if not hasattr(pdb, 'STREAM_TPI'):
+            pdb.STREAM_TPI = pdb.streams[2]
+            pdb.STREAM_TPI.load(unnamed_hack=True, elim_fwdrefs=True)
+        return pdb
+
+    @functools.cached_property
+    def types(self):
+        return self.pdb.STREAM_TPI.types
+
+    @functools.cached_property
+    def _index(self):
+        sig = (os.path.getmtime(self.path), os.path.getsize(self.path))
+        idx = self._load_index(sig)
+        if idx is None:
+            idx = self._build_index()
+            self._save_index(sig, idx)
+        return idx
+
+    structs = functools.cached_property(lambda self: self._index[0])
+    unions = functools.cached_property(lambda self: self._index[1])
+    enums = functools.cached_property(lambda self: self._index[2])
+    _lt = functools.cached_property(lambda self: self._index[3])
+    _flidx = functools.cached_property(lambda self: self._index[4])
+    _name = functools.cached_property(lambda self: self._index[5])
+
+    def _build_index(self):
+        structs, unions, enums = {}, {}, {}
+        lts, flidx, names = {}, {}, {}
+        kinds = {'LF_STRUCTURE': structs, 'LF_STRUCTURE_ST': structs, 'LF_UNION': unions, 'LF_UNION_ST': unions,
+                 'LF_ENUM': enums, 'LF_ENUM_ST': enums}
         for idx, t in self.types.items():
             lt = getattr(t, 'leaf_type', None)
+            lt = lts[idx] = str(lt) if lt else ''
+            d = kinds.get(lt)
+            if d is None: continue
             name = getattr(t, 'name', None)
+            if name is not None: name = str(name)
+            flidx[idx] = _toidx(getattr(t, 'fieldlist', None))
+            names[idx] = name
             if not name or name.startswith('<'): continue
             prop = getattr(t, 'prop', None)
             if prop and getattr(prop, 'fwdref', False): continue
-            if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST'): self.structs[name] = idx
-            elif lt in ('LF_UNION','LF_UNION_ST'): self.unions[name] = idx
-            elif lt in ('LF_ENUM','LF_ENUM_ST'): self.enums[name] = idx
+            d[name] = idx
+        return structs, unions, enums, lts, flidx, names
+
+    def _load_index(self, sig):
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                d = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError): return None
+        if not isinstance(d, dict) or d.get('version') != _IDX_VERSION or d.get('sig') != sig: return None
+        idx = d.get('index')
+        if not isinstance(idx, tuple) or len(idx) != 6 or not all(isinstance(x, dict) for x in idx): return None
+        return idx
+
+    def _save_index(self, sig, idx):
+        try:
+            with open(self.path + '.idx', 'wb') as f:
+                marshal.dump({'version': _IDX_VERSION, 'sig': sig, 'index': idx}, f)
+        except OSError: pass
 
     def _fields(self, fl_idx):
         idx = _toidx(fl_idx)
@@ -83,25 +144,19 @@ class Resolver:
         ti = _toidx(ti)
         if ti is None: return ("void", "")
         if isinstance(ti, int) and ti < 0x1000: return (_resolve_base(ti), "")
-        k = (ti, ctx)
+        k = ti if ctx is None else (ti, ctx)
         if k in self._cache: return self._cache[k]
         t = self.types.get(ti)
         if t is None:
             r = (f"/* 0x{ti:X} */", "")
             self._cache[k] = r
             return r
-        lt = getattr(t, 'leaf_type', '')
-        r = self._leaf(t, lt, ctx)
+        r = self._leaf(ti, t, self._lt[ti], ctx)
         self._cache[k] = r
         return r
 
-    def _leaf(self, t, lt, ctx):
-        if lt == 'LF_POINTER':
-            b, s = self.resolve(_toidx(getattr(t, 'utype', None)))
-            if b.startswith("/* func:"): return (b, s)
-            attr = getattr(t, 'ptr_attr', None)
-            if attr and getattr(attr, 'isconst', False): return (f"{b} * const", s)
-            return (f"{b} *", s)
+    def _leaf(self, ti, t, lt, ctx):
+        if lt in ('LF_POINTER','LF_MODIFIER'): return self._unwind(ti, t, lt)
         if lt in ('LF_ARRAY','LF_ARRAY_ST'):
             et = _toidx(getattr(t, 'elemtype', getattr(t, 'element_type', None)))
             sz = getattr(t, 'size', 0)
@@ -110,15 +165,6 @@ class Resolver:
             if esz and esz > 0: return (b, f"[{sz//esz}]")
             if sz > 0: return (b, f"[/* {sz}b */]")
             return (b, "[]")
-        if lt == 'LF_MODIFIER':
-            b, s = self.resolve(_toidx(getattr(t, 'modified_type', None)))
-            mod = getattr(t, 'modifier', None)
-            p = []
-            if mod:
-                if getattr(mod, 'MOD_const', False): p.append("const")
-                if getattr(mod, 'MOD_volatile', False): p.append("volatile")
-            if p: return (" ".join(p) + " " + b, s)
-            return (b, s)
         if lt == 'LF_BITFIELD':
             b, _ = self.resolve(_toidx(getattr(t, 'base_type', None)))
             return (b, f" : {getattr(t, 'length', 0)}")
@@ -132,6 +178,38 @@ class Resolver:
             return self._proc(t)
         return (f"/* {lt} */", "")
 
+    def _unwind(self, root, t, lt):
+        # follow LF_POINTER/LF_MODIFIER links without recursing, then wrap the
+        # innermost type outward, caching every intermediate link on the way
+        chain = [(None, t, lt)]
+        seen = {root}
+        while True:
+            ti = _toidx(getattr(t, 'utype' if lt == 'LF_POINTER' else 'modified_type', None))
+            if ti is None or ti < 0x1000 or ti in self._cache: break
+            if ti in seen: break
+            t = self.types.get(ti)
+            if t is None: break
+            lt = self._lt[ti]
+            if lt not in ('LF_POINTER','LF_MODIFIER'): break
+            seen.add(ti)
+            chain.append((ti, t, lt))
+        # a repeated index means a cyclic chain in a malformed PDB
+        b, s = (f"/* 0x{ti:X} */", "") if ti in seen else self.resolve(ti)
+        for ti, t, lt in reversed(chain):
+            if lt == 'LF_POINTER':
+                if not b.startswith("/* func:"):
+                    attr = getattr(t, 'ptr_attr', None)
+                    b = f"{b} * const" if attr and getattr(attr, 'isconst', False) else f"{b} *"
+            else:
+                mod = getattr(t, 'modifier', None)
+                p = []
+                if mod:
+                    if getattr(mod, 'MOD_const', False): p.append("const")
+                    if getattr(mod, 'MOD_volatile', False): p.append("volatile")
+                if p: b = " ".join(p) + " " + b
+            if ti is not None: self._cache[ti] = (b, s)
+        return (b, s)
+
     def _proc(self, t):
         ret, _ = self.resolve(_toidx(getattr(t, 'rvtype', None)))
         ali = _toidx(getattr(t, 'arglist', None))
@@ -141,22 +219,26 @@ class Resolver:
             if al:
                 ats = getattr(al, 'arg_type', [])
                 if hasattr(ats, '__iter__') and not isinstance(ats, (str, bytes)):
-                    a = [f"{self.resolve(_toidx(x))[0]}{self.resolve(_toidx(x))[1]}" for x in ats]
+                    resolve = self.resolve
+                    a = []
+                    for x in ats:
+                        b, s = resolve(_toidx(x))
+                        a.append(f"{b}{s}")
                     if a: args = ", ".join(a)
         return (f"/* func: {ret} (*)({args}) */", "")
 
     def _sz(self, ti):
         ti = _toidx(ti)
         if ti is None: return 0
-        if isinstance(ti, int) and ti < 0x1000:
-            mode = (ti >> 8) & 0xF
-            if mode in (4,5): return 4
-            if mode == 6: return 8
-            if mode in (1,2,3): return 2
-            return _BASE_SZ.get(ti & 0xFF, 0)
+        if isinstance(ti, int) and ti < 0x1000: return _base_sz(ti)
+        if ti in self._sz_cache: return self._sz_cache[ti]
+        r = self._sz_cache[ti] = self._sz_leaf(ti)
+        return r
+
+    def _sz_leaf(self, ti):
         t = self.types.get(ti)
         if t is None: return 0
-        lt = getattr(t, 'leaf_type', '')
+        lt = self._lt[ti]
         if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST','LF_UNION','LF_UNION_ST'):
             return getattr(t, 'size', 0)
         if lt in ('LF_ENUM','LF_ENUM_ST'):
@@ -189,78 +271,87 @@ class Resolver:
     def _fmt(self, ti):
         t = self.types.get(ti)
         if t is None: return ""
-        lt = getattr(t, 'leaf_type', '')
-        name = getattr(t, 'name', '')
-        if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST'): return self._fmt_struct(t, name, "struct")
-        if lt in ('LF_UNION','LF_UNION_ST'): return self._fmt_struct(t, name, "union")
-        if lt in ('LF_ENUM','LF_ENUM_ST'): return self._fmt_enum(t, name)
+        lt = self._lt[ti]
+        name = self._name.get(ti) or ''
+        if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST'): return self._fmt_struct(t, ti, name, "struct")
+        if lt in ('LF_UNION','LF_UNION_ST'): return self._fmt_struct(t, ti, name, "union")
+        if lt in ('LF_ENUM','LF_ENUM_ST'): return self._fmt_enum(ti, name)
         return ""
 
-    def _fmt_struct(self, t, name, kw):
+    def _fmt_struct(self, t, ti, name, kw):
         sz = getattr(t, 'size', 0)
-        lines = [f"typedef {kw} {name}", "{"]
-        for f in self._fields(getattr(t, 'fieldlist', None)):
+        parts = ["typedef %s %s\n{\n" % (kw, name)]
+        for f in self._fields(self._flidx[ti]):
             flt = getattr(f, 'leaf_type', '')
             if flt in ('LF_MEMBER','LF_MEMBER_ST'):
                 off = getattr(f, 'offset', 0)
                 fn = getattr(f, 'name', '?')
                 ts, sx = self.resolve(_toidx(getattr(f, 'index', None)))
-                lines.append(f"  /* 0x{off:04X} */ {ts} {fn}{sx};")
+                parts.append("  /* 0x%04X */ %s %s%s;\n" % (off, ts, fn, sx))
             elif flt in ('LF_NESTTYPE','LF_NESTTYPE_ST'):
                 nn = getattr(f, 'name', '')
-                if nn: lines.append(f"  /* nested: {nn} */")
+                if nn: parts.append("  /* nested: %s */\n" % nn)
             elif flt in ('LF_STMEMBER','LF_STMEMBER_ST'):
                 fn = getattr(f, 'name', '?')
                 ts, sx = self.resolve(_toidx(getattr(f, 'index', None)))
-                lines.append(f"  /* static */ {ts} {fn}{sx};")
+                parts.append("  /* static */ %s %s%s;\n" % (ts, fn, sx))
             elif flt in ('LF_BCLASS','LF_BCLASS_ST'):
                 bs, _ = self.resolve(_toidx(getattr(f, 'index', None)))
                 off = getattr(f, 'offset', 0)
-                lines.append(f"  /* 0x{off:04X} */ /* base: {bs} */")
+                parts.append("  /* 0x%04X */ /* base: %s */\n" % (off, bs))
         td = name[1:] if name.startswith('_') else name
-        lines.append(f"}} {td}, *P{td}; /* 0x{sz:X} */")
-        return "\n".join(lines) + "\n"
+        parts.append("} %s, *P%s; /* 0x%X */\n" % (td, td, sz))
+        return "".join(parts)
 
-    def _fmt_enum(self, t, name):
-        lines = [f"typedef enum {name}", "{"]
-        fields = self._fields(getattr(t, 'fieldlist', None))
+    def _fmt_enum(self, ti, name):
+        parts = ["typedef enum %s\n{\n" % name]
+        fields = self._fields(self._flidx[ti])
+        last = len(fields) - 1
         for i, f in enumerate(fields):
             if getattr(f, 'leaf_type', '') in ('LF_ENUMERATE','LF_ENUMERATE_ST'):
                 en = getattr(f, 'name', '')
                 ev = getattr(f, 'value', 0)
-                c = "," if i < len(fields)-1 else ""
-                lines.append(f"  {en} = 0x{ev:X}{c}")
+                parts.append("  %s = 0x%X%s\n" % (en, ev, "," if i < last else ""))
         td = name[1:] if name.startswith('_') else name
-        lines.append(f"}} {td};")
-        return "\n".join(lines) + "\n"
+        parts.append("} %s;\n" % td)
+        return "".join(parts)
 
     def _deps(self, ti, visited):
         ti = _toidx(ti)
         if ti is None or ti in visited: return []
         visited.add(ti)
-        t = self.types.get(ti)
-        if t is None: return []
-        lt = getattr(t, 'leaf_type', '')
         deps = []
-        if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST','LF_UNION','LF_UNION_ST'):
-            for f in self._fields(getattr(t, 'fieldlist', None)):
-                if getattr(f, 'leaf_type', '') in ('LF_MEMBER','LF_MEMBER_ST'):
-                    d = self._find_dep(_toidx(getattr(f, 'index', None)))
-                    if d and d != ti:
-                        deps.extend(self._deps(d, visited))
-                        deps.append(d)
+        stack = [(ti, self._member_deps(ti))]
+        while stack:
+            cur, it = stack[-1]
+            for d in it:
+                if d not in visited:
+                    visited.add(d)
+                    stack.append((d, self._member_deps(d)))
+                    break
+                deps.append(d)
+            else:
+                stack.pop()
+                if stack: deps.append(cur)
         return deps
 
+    def _member_deps(self, ti):
+        if self._lt.get(ti) not in ('LF_STRUCTURE','LF_STRUCTURE_ST','LF_UNION','LF_UNION_ST'): return
+        for f in self._fields(self._flidx[ti]):
+            if getattr(f, 'leaf_type', '') in ('LF_MEMBER','LF_MEMBER_ST'):
+                d = self._find_dep(_toidx(getattr(f, 'index', None)))
+                if d and d != ti: yield d
+
     def _find_dep(self, ti):
         ti = _toidx(ti)
         if ti is None or (isinstance(ti, int) and ti < 0x1000): return None
-        t = self.types.get(ti)
-        if t is None: return None
-        lt = getattr(t, 'leaf_type', '')
+        lt = self._lt.get(ti)
+        if lt is None: return None
+        t = self.types[ti]
         if lt in ('LF_STRUCTURE','LF_STRUCTURE_ST','LF_UNION','LF_UNION_ST','LF_ENUM','LF_ENUM_ST'):
             prop = getattr(t, 'prop', None)
             if prop and getattr(prop, 'fwdref', False):
-                n = getattr(t, 'name', '')
+                n = self._name[ti] or ''
                 return self.structs.get(n) or self.unions.get(n) or self.enums.get(n)
             return ti
         if lt == 'LF_POINTER': return None
@@ -296,36 +387,44 @@ def main():
         print(f"'{pdb_path}' not found", file=sys.stderr); sys.exit(1)
 
     print(f"Loading {pdb_path}...", file=sys.stderr)
-    try: r = Resolver(pdb_path)
+    try:
+        r = Resolver(pdb_path)
+        print(f"{len(r.structs)} structs, {len(r.unions)} unions, {len(r.enums)} enums", file=sys.stderr)
+        if not (args.search or args.list or args.symbol is None): r.types
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr); sys.exit(1)
 
-    print(f"{len(r.structs)} structs, {len(r.unions)} unions, {len(r.enums)} enums", file=sys.stderr)
-
-    out = open(args.output, 'w') if args.output else sys.stdout
+    if args.output: out = open(args.output, 'w', buffering=1 << 20)
+    elif hasattr(sys.stdout, 'buffer'):
+        out = io.TextIOWrapper(sys.stdout.buffer, encoding=sys.stdout.encoding, errors=sys.stdout.errors,
+                               line_buffering=False, write_through=False)
+    else: out = sys.stdout
 
     try:
         if args.search:
             q = args.search.upper()
-            for n in r.list_all():
-                if q in n.upper(): print(n, file=out)
+            out.writelines(n + "\n" for n in r.list_all() if q in n.upper())
             return
         if args.list or args.symbol is None:
-            for n in r.list_all(): print(n, file=out)
+            out.writelines(n + "\n" for n in r.list_all())
             return
 
-        print(f"/*\n * PDB: {os.path.basename(pdb_path)}\n */\n", file=out)
+        out.write(f"/*\n * PDB: {os.path.basename(pdb_path)}\n */\n\n")
 
         if args.symbol == '*':
-            for n in r.list_all():
-                c = r.dump(n)
-                if c and 'not found' not in c: print(c, file=out)
+            chunks = (r.dump(n) for n in r.list_all())
+            out.writelines(c + "\n" for c in chunks if c and 'not found' not in c)
         else:
-            print(r.dump(args.symbol, inline=args.inline_all), file=out)
+            out.write(r.dump(args.symbol, inline=args.inline_all) + "\n")
     finally:
-        if args.output and out != sys.stdout:
+        if args.output:
             out.close()
             print(f"-> {args.output}", file=sys.stderr)
+        elif out is not sys.stdout:
+            try: out.flush()
+            finally: out.detach()
+        else:
+            out.flush()
 
 if __name__ == '__main__':
     main()